@@ -1,19 +1,34 @@
 import hashlib
 from .utils import BlockHash  # ייבוא BlockHash
 from .transaction import Transaction  # ייבוא Transaction
-from typing import List  # עבור רשימות
+from typing import List, Optional, Tuple  # עבור רשימות
 
 class Block:
+    __slots__ = ('prev_block_hash', 'transactions', '_cached_hash', '_cached_from')
+
     def __init__(self, prev_block_hash: BlockHash, transactions: List[Transaction]) -> None:
         self.prev_block_hash = prev_block_hash
         self.transactions = transactions
+        # cached result of get_block_hash(), with the previous hash and the transactions it was built from
+        self._cached_hash: Optional[BlockHash] = None
+        self._cached_from: Optional[Tuple[BlockHash, Tuple[Transaction, ...]]] = None
 
     def get_block_hash(self) -> BlockHash:
         """
         Computes the hash of the block's data, including its transactions and the previous block's hash.
+        The result is cached, and recomputed once the previous hash or the list of transactions has changed.
         """
-        data = self.prev_block_hash + b''.join(tx.get_txid() for tx in self.transactions)
-        return BlockHash(hashlib.sha256(data).digest())
+        transactions = tuple(self.transactions)
+        cached_from = self._cached_from
+        # tuples compare items by identity first, so an unchanged list costs no txid comparisons
+        if (self._cached_hash is None or cached_from is None or cached_from[0] is not self.prev_block_hash
+                or cached_from[1] != transactions):
+            # feed the two parts separately so they are not copied into one temporary buffer first
+            h = hashlib.sha256(self.prev_block_hash)
+            h.update(b''.join([tx.get_txid() for tx in transactions]))
+            self._cached_hash = BlockHash(h.digest())
+            self._cached_from = (self.prev_block_hash, transactions)
+        return self._cached_hash
 
     def get_transactions(self) -> List[Transaction]:
         """
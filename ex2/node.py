@@ -1,30 +1,42 @@
-import hashlib
 import secrets
+from collections import OrderedDict, deque
 
 from .utils import *
 from .block import Block
 from .transaction import Transaction
-from typing import Set, Optional, List
+from typing import Set, Optional, List, Dict, Tuple, ClassVar, Deque, Callable
 
 class Node:
+    # signatures that already passed verification, shared by all nodes: (message, signature, public key) in LRU order
+    _verify_cache: ClassVar['OrderedDict[Tuple[bytes, Signature, PublicKey], None]'] = OrderedDict()
+    _VERIFY_CACHE_SIZE: ClassVar[int] = 4096
+
     def __init__(self) -> None:
         self.private_key, self.public_key = gen_keys()
-        self.mempool: List[Transaction] = []  # list of transactions waiting to be mined
+        self.mempool: Deque[Transaction] = deque()  # transactions waiting to be mined, oldest first
+        self._mempool_by_input: Dict[TxID, Transaction] = {}  # mempool transactions indexed by the coin they spend
         self.connections: Set[Node] = set()  # connected nodes
-        self.blocks: dict[BlockHash, Block] = {}  # list of blocks known to this node
+        self.blocks: Dict[BlockHash, Block] = {}  # blocks known to this node, indexed by hash
+        self._heights: Dict[BlockHash, int] = {GENESIS_BLOCK_PREV: 0}  # length of the chain ending at each block
         self.latest_block_hash: BlockHash = GENESIS_BLOCK_PREV  # latest block hash in the chain
-        self.utxo: List[Transaction] = []  # list of unspent transactions
+        self.utxo: Dict[TxID, Transaction] = {}  # unspent transactions indexed by txid
+        self._utxo_by_owner: Dict[PublicKey, Dict[TxID, Transaction]] = {}  # unspent transactions grouped by owner
+        self._all_txs_by_id: Dict[TxID, Transaction] = {}  # every transaction ever applied, to restore coins on rollback
 
     def connect(self, other: 'Node') -> None:
         # if other is self cannot connect to itself
         if other == self:
             raise ValueError("Node cannot connect to itself.")
+        # already connected nodes are kept in sync by the block gossip
+        if other in self.connections:
+            return
         # add the other node to the connections set
         self.connections.add(other)
         # add self to the other node connections set
         other.connections.add(self)
-        # notify the other node of the latest block
-        other.notify_of_block(self.latest_block_hash, self)
+        # each node learns the other's latest block, so whichever chain is longer is adopted by both
+        other.notify_of_block(self.get_latest_hash(), self)
+        self.notify_of_block(other.get_latest_hash(), other)
 
     def disconnect_from(self, other: 'Node') -> None:
         # remove the other node from the connections set
@@ -45,201 +57,252 @@ class Node:
 
         If the transaction is added successfully, then it is also sent to neighboring nodes.
         """
-        # make sure the transaction is valid
-        if not verify(transaction.get_txid(), transaction.signature, transaction.output):
+        if not self._accept_transaction(transaction):
+            return False
+        # send the transaction to the connected nodes; every node that accepts it passes it on
+        self._gossip(lambda receiver, sender: receiver._accept_transaction(transaction))
+        return True
+
+    def _accept_transaction(self, transaction: Transaction) -> bool:
+        """
+        Validates the transaction and adds it to the mempool, without sending it to other nodes.
+        Returns True if it was added.
+        """
+        # money creation transactions are only valid inside a mined block
+        if transaction.input is None:
+            return False
+        # a transaction we already hold was gossiped back to us, so there is nothing to validate or propagate
+        if self._mempool_by_input.get(transaction.input) == transaction:
+            return False
+        # make sure the source has the coin that it tries to spend
+        input_tx = self.utxo.get(transaction.input)
+        if input_tx is None:
             return False
-        # make sure the transaction is not already in the mempool
-        if transaction.input and transaction.input not in [tx.get_txid() for tx in self.utxo]:
+        # make sure no transaction in the mempool already spends this coin
+        if transaction.input in self._mempool_by_input:
+            return False
+        # make sure the transaction was signed by the owner of the coin
+        if not self._verify(transaction.get_signed_message(), transaction.signature, input_tx.output):
             return False
 
-        # update UTXO
-        self.utxo = [tx for tx in self.utxo if tx.get_txid() != transaction.input]
-        # add the transaction to the UTXO
+        # add the transaction to the mempool
         self.mempool.append(transaction)
-        # send the transaction to the connected nodes
-        for node in self.connections:
-            node.add_transaction_to_mempool(transaction)
-
+        self._mempool_by_input[transaction.input] = transaction
         return True
 
     def notify_of_block(self, block_hash: BlockHash, sender: 'Node') -> None:
         """Notifies the node about a new block while allowing valid blocks to be added."""
+        if self._receive_block(block_hash, sender):
+            # Notify neighbors about the new tip (the sender already has it)
+            self._announce_block(exclude=sender)
+
+    def _receive_block(self, block_hash: BlockHash, sender: 'Node') -> bool:
+        """
+        Fetches the unknown blocks leading to block_hash from the sender and switches to them if they form
+        a longer valid chain. Returns True if the latest block of this node changed.
+        """
+        # the sender is on our tip (this includes two nodes that are both still at genesis)
+        if block_hash == self.latest_block_hash:
+            return False
         if block_hash in self.blocks:
             print(f"[DEBUG] Block {block_hash} already known.")
-            return
+            return False
 
-        # Temporary storage for validated blocks
-        valid_blocks = []
+        # Collect the blocks we don't know yet, walking back from the new tip to a known block or to genesis.
+        unknown_blocks = []
         current_hash = block_hash
-
-
         while current_hash != GENESIS_BLOCK_PREV and current_hash not in self.blocks:
             try:
                 block = sender.get_block(current_hash)
             except ValueError:
-                print(f"[DEBUG] Could not retrieve block {current_hash}. Stopping processing.")
-                break
-
+                print(f"[DEBUG] Could not retrieve block {current_hash}. Chain does not lead to genesis.")
+                return False
 
-            if self._is_valid_block(block):
-                valid_blocks.append(block)
-            else:
-                print(f"[DEBUG] Invalid block {block.get_block_hash()}. Ignoring this block.")
-                break  # Stop further processing when encountering an invalid block
+            # the sender must serve the block that was asked for
+            if block.get_block_hash() != current_hash:
+                print(f"[DEBUG] Block {current_hash} was served with wrong contents. Stopping processing.")
+                return False
 
+            unknown_blocks.append(block)
             current_hash = block.get_prev_block_hash()
 
+        unknown_blocks.reverse()
 
-        # Add valid blocks in reverse order to maintain chain order
-        for block in reversed(valid_blocks):
-            self.blocks[block.get_block_hash()] = block
-            if current_hash == GENESIS_BLOCK_PREV:
-                valid_blocks.append(block)
-            else:
-                print(f"[DEBUG] Chain does not lead to genesis. Stopping processing.")
-                break
+        # A branch that is not longer than our chain even if all of its blocks are valid is not worth validating
+        if self._get_chain_length(current_hash) + len(unknown_blocks) <= self._get_chain_length(self.latest_block_hash):
+            return False
 
-        # Check if this is now the longest chain
-        if self._get_chain_length(block_hash) > self._get_chain_length(self.latest_block_hash):
-            self._reorganize_chain(block_hash)
+        # The unknown blocks extend current_hash, which may itself be on a side branch we already know
+        split_point = self._find_split_point(self.latest_block_hash, current_hash)
+        new_chain = self._get_chain_to_tip(current_hash, split_point)[::-1] + unknown_blocks
 
-        # Notify neighbors about the latest valid block
-        if valid_blocks and valid_blocks[-1].get_block_hash() == self.latest_block_hash:
-            for neighbor in self.connections:
-                neighbor.notify_of_block(self.latest_block_hash, self)
+        old_tip = self.latest_block_hash
+        self._reorganize_chain(split_point, new_chain)
+        return self.latest_block_hash != old_tip
 
     def _is_valid_block(self, block: Block) -> bool:
         """
-        Validates a block based on its hash, size, and transactions.
+        Validates a block based on its size and transactions.
         """
-        # Validate block hash
-        expected_hash = BlockHash(hashlib.sha256(
-            block.get_prev_block_hash() + b''.join(tx.get_txid() for tx in block.get_transactions())
-        ).digest())
-        if block.get_block_hash() != expected_hash:
-            print(f"[DEBUG] Invalid block hash for {block.get_block_hash()}.")
-            return False
-
         # Check block size
         if len(block.get_transactions()) > BLOCK_SIZE:
             print(f"[DEBUG] Block {block.get_block_hash()} exceeds block size limit.")
             return False
 
-        # Validate transactions
+        # Validate transactions. Signatures are the expensive part,
+        # so they are only checked once all the cheap checks passed.
         reward_tx_count = 0
         seen_txids = set()
+        spent_inputs = set()
+        signed_txs = []
         for tx in block.get_transactions():
-            if tx.get_txid() in seen_txids:
-                print(f"[DEBUG] Duplicate transaction {tx.get_txid()} in block.")
+            txid = tx.get_txid()
+            if txid in seen_txids:
+                print(f"[DEBUG] Duplicate transaction {txid} in block.")
                 return False
-            seen_txids.add(tx.get_txid())
+            seen_txids.add(txid)
 
             if tx.input is None:  # Reward transaction
                 reward_tx_count += 1
             else:
-                if not self._find_tx_in_utxo(tx):
-                    print(f"[DEBUG] Transaction {tx.get_txid()} references a non-existent or spent input.")
+                # two transactions in the same block cannot spend the same coin
+                if tx.input in spent_inputs:
+                    print(f"[DEBUG] Transaction {txid} double spends an input within the block.")
                     return False
-                if not verify(tx.input + tx.output, tx.signature, tx.output):
-                    print(f"[DEBUG] Transaction {tx.get_txid()} has an invalid signature.")
+                spent_inputs.add(tx.input)
+                input_tx = self.utxo.get(tx.input)
+                if input_tx is None:
+                    print(f"[DEBUG] Transaction {txid} references a non-existent or spent input.")
                     return False
+                signed_txs.append((tx, input_tx.output))
 
         # Ensure only one reward transaction
         if reward_tx_count != 1:
             print(f"[DEBUG] Invalid number of reward transactions in block {block.get_block_hash()}.")
             return False
 
+        return self._verify_signatures(signed_txs)
+
+    def _verify_signatures(self, signed_txs: List[Tuple[Transaction, PublicKey]]) -> bool:
+        """
+        Checks that every transaction was signed by the owner of the coin it spends.
+        Each item is a transaction together with the public key of that owner.
+        """
+        for tx, owner in signed_txs:
+            if not self._verify(tx.get_signed_message(), tx.signature, owner):
+                print(f"[DEBUG] Transaction {tx.get_txid()} has an invalid signature.")
+                return False
+        return True
+
+    def _verify(self, message: bytes, sig: Signature, pub_key: PublicKey) -> bool:
+        """
+        Verifies a signature like verify(), but remembers the signatures that passed
+        so a transaction seen again on reorgs or on block inclusion is not checked twice.
+        """
+        key = (message, sig, pub_key)
+        if key in self._verify_cache:
+            self._verify_cache.move_to_end(key)
+            return True
+        if not verify(message, sig, pub_key):
+            return False
+        self._verify_cache[key] = None
+        if len(self._verify_cache) > self._VERIFY_CACHE_SIZE:
+            self._verify_cache.popitem(last=False)
         return True
 
     def _get_chain_length(self, block_hash: BlockHash) -> int:
         """
-        Computes the length of the chain ending at the given block hash.
+        Returns the length of the chain ending at the given block hash (0 for unknown blocks).
         """
-        length = 0
-        current_hash = block_hash
-        while current_hash in self.blocks:
-            block = self.blocks[current_hash]
-            current_hash = block.get_prev_block_hash()
-            length += 1
-        return length
+        return self._heights.get(block_hash, 0)
 
-    def _reorganize_chain(self, new_tip: BlockHash) -> None:
-        split_point = self._find_split_point(self.latest_block_hash, new_tip)
+    def _reorganize_chain(self, split_point: BlockHash, new_chain: List[Block]) -> None:
+        """
+        Switches to the given blocks, which are built on top of the split point (oldest block first).
+        The blocks are validated as they are applied and only the valid prefix is kept.
+        If that prefix does not make the chain longer, the old chain is restored.
+        """
+        old_length = self._get_chain_length(self.latest_block_hash)
+        old_chain = self._get_chain_to_tip(self.latest_block_hash, split_point)
         self._rollback_to_split_point(split_point)
 
-        # recognize stale transactions that need to be removed from the mempool
-        stale_txs = {tx.get_txid() for block in self._get_chain_to_tip(self.latest_block_hash, split_point)
-                     for tx in block.get_transactions()}
+        try:
+            for block in new_chain:
+                if not self._is_valid_block(block):
+                    print(f"[DEBUG] Invalid block {block.get_block_hash()}. Ignoring it and the blocks after it.")
+                    break
+                self._add_block_to_chain(block)
+        except BaseException:
+            # an error must not leave the node rolled back to the split point, but it still surfaces
+            self._restore_chain(split_point, old_chain)
+            raise
+
+        if self._get_chain_length(self.latest_block_hash) <= old_length:
+            # the valid part of the new chain is not longer, so go back to the old one
+            self._restore_chain(split_point, old_chain)
+            return
 
-        # Roll forward the chain
-        current_hash = new_tip
-        new_chain = []
-        while current_hash != split_point:
-            block = self.blocks[current_hash]
-            new_chain.append(block)
-            current_hash = block.get_prev_block_hash()
-        # Reverse the chain to process it from the split point to the new tip
-        new_chain.reverse()
-        for block in new_chain:
-            for tx in block.get_transactions():
-                if tx.input:
-                    self.utxo = [utxo_tx for utxo_tx in self.utxo if utxo_tx.get_txid() != tx.input]
-                self.utxo.append(tx)
-                stale_txs.discard(tx.get_txid())
-
-        self.latest_block_hash = new_tip
-
-        # Remove stale transactions from the mempool and add the remaining transactions back
-        for tx in self.mempool:
-            if tx.get_txid() not in stale_txs:
+        # Transactions of the abandoned blocks go back to the mempool, and mempool transactions
+        # whose coin is no longer unspent are dropped, all in a single pass
+        candidates = [tx for block in reversed(old_chain) for tx in block.get_transactions() if tx.input is not None]
+        candidates.extend(self.mempool)
+        self.clear_mempool()
+        for tx in candidates:
+            if tx.input is not None and tx.input in self.utxo and tx.input not in self._mempool_by_input:
                 self.mempool.append(tx)
+                self._mempool_by_input[tx.input] = tx
 
-        print(f"[DEBUG] Chain reorganized to new tip: {new_tip}")
+        print(f"[DEBUG] Chain reorganized to new tip: {self.latest_block_hash}")
 
-    def _rollback_to_split_point(self, split_point: BlockHash) -> None:
+    def _restore_chain(self, split_point: BlockHash, old_chain: List[Block]) -> None:
+        """
+        Rolls back to the split point and re-applies the old chain (given newest block first).
+        """
+        self._rollback_to_split_point(split_point)
+        for block in reversed(old_chain):
+            self._add_block_to_chain(block)
 
+    def _rollback_to_split_point(self, split_point: BlockHash) -> None:
+        """
+        Undoes the blocks from the latest block back to the split point:
+        their transactions leave the UTXO and the coins they spent become unspent again.
+        """
         current_hash = self.latest_block_hash
         # while the current hash is not the split point roll back the chain
         while current_hash != split_point:
             if current_hash not in self.blocks:
                 raise ValueError(f"Block {current_hash} is missing in the chain.")
-            # get the block from the blocks dictionary
             block = self.blocks[current_hash]
-            # for each transaction in the block
-            for tx in block.get_transactions():
-                # if the transaction is in the UTXO remove it
-                if tx.get_txid() in [utxo_tx.get_txid() for utxo_tx in self.utxo]:
-                    # remove the transaction from the UTXO
-                    self.utxo = [utxo_tx for utxo_tx in self.utxo if utxo_tx.get_txid() != tx.get_txid()]
-                if tx.input:  # Add back transactions that were rolled back and can still be executed
-                    self.mempool.append(tx)
-            # remove the block from the blocks dictionary
+            # undo the transactions from the newest to the oldest
+            for tx in reversed(block.get_transactions()):
+                self._remove_from_utxo(tx.get_txid())
+                if tx.input is not None:
+                    self._add_to_utxo(self._all_txs_by_id[tx.input])
             current_hash = block.get_prev_block_hash()
+        self.latest_block_hash = split_point
 
     def _find_split_point(self, hash1: BlockHash, hash2: BlockHash) -> BlockHash:
         """
         Finds the common ancestor (split point) between two chains.
         """
-        seen_hashes = set()
-
-        # Traverse both chains until a common ancestor is found
-        while hash1 or hash2:
-            # If a common ancestor is found, return it
-            if hash1 in seen_hashes:
-                return hash1
-            if hash2 in seen_hashes:
-                return hash2
-            # Traverse the first chain
-            if hash1 is not None:
-                seen_hashes.add(hash1)
-                hash1 = self.blocks[hash1].get_prev_block_hash() if hash1 in self.blocks else None
-            # Traverse the second chain
-            if hash2 is not None:
-                seen_hashes.add(hash2)
-                hash2 = self.blocks[hash2].get_prev_block_hash() if hash2 in self.blocks else None
-
-        # If no common ancestor is found, return the genesis block
-        return GENESIS_BLOCK_PREV
+        # If one of the chains is unknown, the only common ancestor is the genesis block
+        if hash1 not in self._heights or hash2 not in self._heights:
+            return GENESIS_BLOCK_PREV
+        height1, height2 = self._heights[hash1], self._heights[hash2]
+
+        # Walk back the longer chain until both are at the same height
+        while height1 > height2:
+            hash1 = self.blocks[hash1].get_prev_block_hash()
+            height1 -= 1
+        while height2 > height1:
+            hash2 = self.blocks[hash2].get_prev_block_hash()
+            height2 -= 1
+
+        # Walk back both chains together until they meet
+        while hash1 != hash2:
+            hash1 = self.blocks[hash1].get_prev_block_hash()
+            hash2 = self.blocks[hash2].get_prev_block_hash()
+        return hash1
 
     def mine_block(self) -> Optional[BlockHash]:
         """
@@ -252,7 +315,11 @@ class Node:
         - If a new block is created, all connections of this node are notified by calling their notify_of_block() method.
         The method returns the new block hash (or None if there was no block)
         """
-        selected_transactions = self.mempool[:BLOCK_SIZE - 1]
+        # take the oldest transactions out of the mempool
+        selected_transactions = [self.mempool.popleft() for _ in range(min(BLOCK_SIZE - 1, len(self.mempool)))]
+        for tx in selected_transactions:
+            if tx.input is not None:
+                self._mempool_by_input.pop(tx.input, None)
         reward_transaction = Transaction(
             output=self.get_address(),
             tx_input=None,
@@ -265,30 +332,75 @@ class Node:
             transactions=transactions
         )
 
+        self._add_block_to_chain(new_block)
         block_hash = new_block.get_block_hash()
-        self.blocks[block_hash] = new_block
+
+        self._announce_block()
+
+        return block_hash
+
+    def _announce_block(self, exclude: Optional['Node'] = None) -> None:
+        """
+        Notifies all connected nodes (except `exclude`) of this node's latest block.
+        Every node that switches to a new tip announces its own latest block in turn.
+        """
+        self._gossip(lambda receiver, sender: receiver._receive_block(sender.latest_block_hash, sender), exclude)
+
+    def _gossip(self, deliver: Callable[['Node', 'Node'], bool], exclude: Optional['Node'] = None) -> None:
+        """
+        Spreads something from this node through the network, breadth first.
+        deliver(receiver, sender) hands it to one neighbor and returns True if that neighbor accepted it,
+        in which case the neighbor passes it on to its own connections (except the sender).
+        The queue is local to this call, so a large network does not deepen the call stack,
+        and an error in one delivery cannot affect announcements made by other calls.
+        """
+        pending: Deque[Tuple[Node, Optional[Node]]] = deque([(self, exclude)])
+        while pending:
+            sender, skip = pending.popleft()
+            for receiver in sender.connections:
+                if receiver is not skip and deliver(receiver, sender):
+                    pending.append((receiver, sender))
+
+    def _add_block_to_chain(self, block: Block) -> None:
+        """
+        Puts the block on top of the latest block and applies its transactions to the UTXO.
+        """
+        block_hash = block.get_block_hash()
+        self.blocks[block_hash] = block
+        self._heights[block_hash] = self._heights[block.get_prev_block_hash()] + 1
         self.latest_block_hash = block_hash
+        self._update_utxo(block.get_transactions())
 
-        # update UTXO with the new block's transactions and remove them from the mempool
-        existing_txids = {tx.get_txid() for tx in self.utxo}
+    def _update_utxo(self, transactions: List[Transaction]) -> None:
+        """
+        Applies the given transactions to the UTXO: spent inputs are removed and the transactions are added.
+        """
         for tx in transactions:
-            # only add transactions that are not already in the UTXO
-            if tx.get_txid() not in existing_txids:
-                self.utxo.append(tx)
-                existing_txids.add(tx.get_txid())
-                self.mempool = self.mempool[BLOCK_SIZE - 1:]
-
-        for neighbor in self.connections:
-            neighbor.notify_of_block(block_hash, self)
+            if tx.input is not None:
+                self._remove_from_utxo(tx.input)
+            self._add_to_utxo(tx)
 
-        return block_hash
+    def _add_to_utxo(self, tx: Transaction) -> None:
+        """
+        Adds an unspent transaction to the UTXO and to its owner's coins,
+        and remembers it so the coin can be restored if a spending block is rolled back.
+        """
+        txid = tx.get_txid()
+        self.utxo[txid] = tx
+        self._all_txs_by_id[txid] = tx
+        self._utxo_by_owner.setdefault(tx.output, {})[txid] = tx
 
-    def _find_tx_in_utxo(self, tx: Transaction) -> bool:
+    def _remove_from_utxo(self, txid: TxID) -> None:
         """
-        Check if a transaction exists in the UTXO based on its TXID.
+        Removes a transaction from the UTXO and from its owner's coins, if it is there.
         """
-        # Check if the transaction is in the UTXO
-        return any(utxo_tx.get_txid() == tx.get_txid() for utxo_tx in self.utxo)
+        tx = self.utxo.pop(txid, None)
+        if tx is None:
+            return
+        owned = self._utxo_by_owner[tx.output]
+        del owned[txid]
+        if not owned:
+            del self._utxo_by_owner[tx.output]
 
     def get_block(self, block_hash: BlockHash) -> Block:
         """
@@ -309,13 +421,13 @@ class Node:
         """
         Returns the list of transactions in the mempool.
         """
-        return self.mempool
+        return list(self.mempool)
 
     def get_utxo(self) -> List[Transaction]:
         """
         Returns a copy of the list of unspent transactions (UTXO).
         """
-        return self.utxo.copy()
+        return list(self.utxo.values())
     # ------------ Formerly wallet methods: -----------------------
 
     def create_transaction(self, target: PublicKey) -> Optional[Transaction]:
@@ -323,13 +435,12 @@ class Node:
         Returns a signed transaction that moves an unspent coin to the target.
         Returns None if there are no unspent coins available.
         """
-        # search for an unspent transaction
-        for tx in self.utxo:
-            if not any(mempool_tx.input == tx.get_txid() for mempool_tx in self.mempool):
+        # search for an unspent coin of ours that is not already being spent in the mempool
+        for txid in self._utxo_by_owner.get(self.public_key, {}):
+            if txid not in self._mempool_by_input:
                 # create a new transaction
-                txid = tx.get_txid()
                 private_key = self.private_key  # the private key of the sender
-                signature = sign(txid, private_key) # sign the transaction ID
+                signature = sign(txid + target, private_key)  # sign the input and the output
                 # create a new transaction
                 new_transaction = Transaction(
                     output=target,
@@ -349,7 +460,8 @@ class Node:
         """
         Clears the mempool of this node. All transactions waiting to be entered into the next block are gone.
         """
-        self.mempool = []
+        self.mempool = deque()
+        self._mempool_by_input = {}
 
     def get_balance(self) -> int:
         """
@@ -357,11 +469,8 @@ class Node:
         Coins that the node owned and sent away will still be considered as part of the balance
         until the spending transaction is in the blockchain.
         """
-        balance = 0
-        for tx in self.utxo:
-            if tx.output == self.public_key:
-                balance += 1  # each transaction is worth 1 coin
-        return balance
+        # each transaction is worth 1 coin
+        return len(self._utxo_by_owner.get(self.public_key, {}))
 
     def get_address(self) -> PublicKey:
         """
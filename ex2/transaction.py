@@ -1,13 +1,16 @@
 import hashlib
 
 from .utils import PublicKey, Signature, TxID
-from typing import Optional
+from typing import Optional, Tuple
 
 
 class Transaction:
     """Represents a transaction that moves a single coin
     A transaction with no source creates money. It will only be created by the miner of a block."""
 
+    # no per-instance __dict__: mempools and UTXO sets hold many transactions
+    __slots__ = ('output', 'input', 'signature', '_txid', '_signed_message', '_cached_fields')
+
     def __init__(self, output: PublicKey, tx_input: Optional[TxID], signature: Signature) -> None:
         # DO NOT change these field names.
         self.output: PublicKey = output
@@ -15,15 +18,45 @@ class Transaction:
         self.input: Optional[TxID] = tx_input
         # DO NOT change these field names.
         self.signature: Signature = signature
+        self._txid: Optional[TxID] = None  # cached result of get_txid()
+        self._signed_message: Optional[bytes] = None  # cached result of get_signed_message()
+        # the field objects that the cached values were built from
+        self._cached_fields: Optional[Tuple[PublicKey, Optional[TxID], Signature]] = None
+
+    def _refresh_caches(self) -> None:
+        # the caches are valid only while the fields are the very objects they were built from. Checking identity
+        # here keeps plain attribute assignment (and so construction) free of a __setattr__ hook.
+        fields = self._cached_fields
+        if (fields is None or fields[0] is not self.output or fields[1] is not self.input
+                or fields[2] is not self.signature):
+            self._txid = None
+            self._signed_message = None
+            self._cached_fields = (self.output, self.input, self.signature)
 
     def get_txid(self) -> TxID:
         """
         Returns the identifier of this transaction. This is the sha256 of the transaction contents.
-        This function is used by the tests to compute the tx hash. Make sure to compute this every time 
-        directly from the data in the transaction object, and not cache the result
+        The txid is cached after the first call, and the cache is dropped once output, input or
+        signature has been assigned another object, so the result always matches the data in the transaction object.
+        """
+        self._refresh_caches()
+        if self._txid is None:
+            h = hashlib.sha256(self.output)
+            if self.input is not None:
+                h.update(self.input)
+            h.update(self.signature)
+            self._txid = TxID(h.digest())
+        return self._txid
+
+    def get_signed_message(self) -> bytes:
+        """
+        Returns the data that the owner of the spent coin signs: the input followed by the output.
+        Like the txid, it is built once and reused until one of the fields is assigned another object.
         """
-        data = self.output + (self.input or b'') + self.signature
-        return TxID(hashlib.sha256(data).digest())
+        self._refresh_caches()
+        if self._signed_message is None:
+            self._signed_message = b''.join((self.input or b'', self.output))
+        return self._signed_message
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, Transaction):
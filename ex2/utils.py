@@ -1,5 +1,5 @@
-from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat, PrivateFormat, NoEncryption
-from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from nacl.exceptions import BadSignatureError
+from nacl.signing import SigningKey, VerifyKey
 from typing import NewType, Tuple
 
 # The following types are used to distinguish between bytes that are used as private keys, public keys and signature.
@@ -21,29 +21,25 @@ BLOCK_SIZE = 10
 
 def sign(message: bytes, private_key: PrivateKey) -> Signature:
     """Signs the given message using the given private key"""
-    pk = Ed25519PrivateKey.from_private_bytes(
-        private_key)
-    return Signature(pk.sign(message))
+    pk = SigningKey(private_key)
+    return Signature(pk.sign(message).signature)
 
 
 def verify(message: bytes, sig: Signature, pub_key: PublicKey) -> bool:
     """Verifies a signature for a given message using a public key. 
     Returns True is the signature matches, otherwise False"""
-    pub_k = Ed25519PublicKey.from_public_bytes(
-        pub_key)
     try:
-        pub_k.verify(sig, message)
+        VerifyKey(pub_key).verify(message, sig)
         return True
-    except:
+    except (BadSignatureError, ValueError, TypeError):
+        # a forged signature, or a key or signature that is not valid Ed25519 data
         return False
 
 
 def gen_keys() -> Tuple[PrivateKey, PublicKey]:
     """generates a private key and a corresponding public key. 
     The keys are returned in byte format to allow them to be serialized easily."""
-    private_key = Ed25519PrivateKey.generate()
-    priv_key_bytes = private_key.private_bytes(
-        Encoding.Raw, PrivateFormat.Raw, encryption_algorithm=NoEncryption())
-    pub_key_bytes = private_key.public_key().public_bytes(
-        Encoding.Raw, PublicFormat.Raw)
+    private_key = SigningKey.generate()
+    priv_key_bytes = bytes(private_key)
+    pub_key_bytes = bytes(private_key.verify_key)
     return PrivateKey(priv_key_bytes), PublicKey(pub_key_bytes)
@@ -1,7 +1,9 @@
 import pytest
+import ex2.node
+from collections import OrderedDict
 from unittest.mock import Mock
-from typing import Callable, List
-from ex2 import Node, Block, BlockHash
+from typing import Any, Callable, List, Tuple
+from ex2 import Node, Block, BlockHash, PublicKey, Signature, verify
 
 
 @pytest.fixture
@@ -36,3 +38,17 @@ def evil_node_maker() -> Callable[[List[Block]], Mock]:
         return evil_node
 
     return factory
+
+
+@pytest.fixture
+def verify_calls(monkeypatch: Any) -> List[Tuple[bytes, Signature, PublicKey]]:
+    """Starts with an empty verify cache and records every signature check that reaches utils.verify."""
+    calls: List[Tuple[bytes, Signature, PublicKey]] = []
+
+    def counting_verify(message: bytes, sig: Signature, pk: PublicKey) -> bool:
+        calls.append((message, sig, pk))
+        return verify(message, sig, pk)
+
+    monkeypatch.setattr(Node, "_verify_cache", OrderedDict())
+    monkeypatch.setattr(ex2.node, "verify", counting_verify)
+    return calls
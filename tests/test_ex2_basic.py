@@ -1,4 +1,5 @@
 from ex2 import *
+import ex2.node
 import pytest
 import secrets
 import hashlib
@@ -309,3 +310,187 @@ def test_bob_serves_wrong_block(alice: Node, bob: Node, charlie: Node, monkeypat
     alice.connect(bob)
     assert alice.get_latest_hash() == GENESIS_BLOCK_PREV
     assert alice.get_utxo() == []
+
+
+def test_txid_follows_changed_fields(alice: Node, bob: Node) -> None:
+    tx = Transaction(alice.get_address(), None, Signature(secrets.token_bytes(64)))
+    txid = tx.get_txid()
+    assert tx.get_txid() == txid
+    assert tx.get_signed_message() == alice.get_address()
+    tx.output = bob.get_address()
+    assert tx.get_txid() != txid
+    assert tx.get_txid() == hashlib.sha256(tx.output + tx.signature).digest()
+    assert tx.get_signed_message() == bob.get_address()
+
+
+def test_sent_coin_counts_in_balance_until_mined(alice: Node, bob: Node) -> None:
+    alice.connect(bob)
+    alice.mine_block()
+    tx = alice.create_transaction(bob.get_address())
+    assert tx is not None
+    assert tx in bob.get_mempool()
+    assert alice.get_balance() == 1
+    alice.mine_block()
+    assert tx in alice.get_utxo()
+    assert alice.get_balance() == 1
+    assert bob.get_balance() == 1
+    assert bob.get_mempool() == []
+
+
+def test_gossip_verifies_each_tx_once_per_node(alice: Node, bob: Node, charlie: Node, monkeypatch: Any,
+                                               verify_calls: List[Any]) -> None:
+    alice.connect(bob)
+    bob.connect(charlie)
+    charlie.connect(alice)
+    alice.mine_block()
+
+    monkeypatch.setattr(Node, "_VERIFY_CACHE_SIZE", 0)
+    tx = alice.create_transaction(bob.get_address())
+    assert tx in bob.get_mempool() and tx in charlie.get_mempool()
+    assert len(verify_calls) == 3
+
+
+def test_block_with_two_spends_of_one_coin_is_invalid(alice: Node, bob: Node, charlie: Node,
+                                                      evil_node_maker: EvilNodeMaker) -> None:
+    h1 = alice.mine_block()
+    assert h1 is not None
+    block1 = alice.get_block(h1)
+    utxo = alice.get_utxo()
+    coin = utxo[0].get_txid()
+    tx1 = Transaction(bob.get_address(), coin, sign(coin + bob.get_address(), alice.private_key))
+    tx2 = Transaction(charlie.get_address(), coin, sign(coin + charlie.get_address(), alice.private_key))
+    reward = Transaction(alice.get_address(), None, Signature(secrets.token_bytes(48)))
+
+    double_spend = Block(h1, [tx1, tx2, reward])
+    evil_node = evil_node_maker([block1, double_spend])
+    alice.notify_of_block(evil_node.get_latest_hash(), evil_node)
+    assert alice.get_latest_hash() == h1
+    assert alice.get_utxo() == utxo
+
+    single_spend = Block(h1, [tx1, reward])
+    evil_node = evil_node_maker([block1, single_spend])
+    alice.notify_of_block(evil_node.get_latest_hash(), evil_node)
+    assert alice.get_latest_hash() == single_spend.get_block_hash()
+    assert set(alice.get_utxo()) == {tx1, reward}
+
+
+def test_verified_signatures_are_cached(alice: Node, bob: Node, verify_calls: List[Any]) -> None:
+    alice.connect(bob)
+    alice.mine_block()
+
+    tx = alice.create_transaction(bob.get_address())
+    assert tx in bob.get_mempool()
+    alice.mine_block()
+    assert tx in bob.get_utxo()
+    assert len(verify_calls) == 1
+
+
+def test_fork_is_validated_against_its_own_history(alice: Node, bob: Node) -> None:
+    alice.mine_block()
+    bob.mine_block()
+    tx = bob.create_transaction(alice.get_address())
+    assert tx is not None
+    bob.mine_block()
+
+    alice.notify_of_block(bob.get_latest_hash(), bob)
+    assert alice.get_latest_hash() == bob.get_latest_hash()
+    assert set(alice.get_utxo()) == set(bob.get_utxo())
+    assert tx in alice.get_utxo()
+    assert alice.get_balance() == 1
+
+
+def test_fork_switches_at_split_point(alice: Node, bob: Node) -> None:
+    h1 = alice.mine_block()
+    h2 = alice.mine_block()
+    alice.connect(bob)
+    alice.disconnect_from(bob)
+    h3 = bob.mine_block()
+    h4 = alice.mine_block()
+    h5 = bob.mine_block()
+    assert h1 is not None and h2 is not None and h3 is not None and h4 is not None and h5 is not None
+    abandoned_reward = alice.get_block(h4).get_transactions()[-1]
+
+    alice.notify_of_block(h5, bob)
+    # the blocks up to the split point h2 are kept, and alice's block after it is replaced by bob's two
+    assert alice.get_latest_hash() == h5
+    assert alice.get_block(h5).get_prev_block_hash() == h3
+    assert alice.get_block(h3).get_prev_block_hash() == h2
+    assert set(alice.get_utxo()) == set(bob.get_utxo())
+    assert abandoned_reward not in alice.get_utxo()
+    assert alice.get_balance() == 2
+
+    # a tip that cannot be traced back to a known block leaves the chain as it is
+    stranger = Mock()
+    stranger.get_block.side_effect = ValueError
+    alice.notify_of_block(BlockHash(b"unknown"), stranger)
+    assert alice.get_latest_hash() == h5
+    assert set(alice.get_utxo()) == set(bob.get_utxo())
+
+
+def test_blocks_propagate_through_a_long_line_of_nodes() -> None:
+    nodes = [Node() for _ in range(1500)]
+    for left, right in zip(nodes, nodes[1:]):
+        left.connect(right)
+    block_hash = nodes[0].mine_block()
+    assert nodes[-1].get_latest_hash() == block_hash
+
+
+def test_verify_rejects_malformed_keys_and_signatures(alice: Node) -> None:
+    message = b"message"
+    signature = sign(message, alice.private_key)
+    assert verify(message, signature, alice.get_address())
+    assert not verify(message, signature, PublicKey(b"short"))
+    assert not verify(message, Signature(b"short"), alice.get_address())
+
+
+@pytest.mark.parametrize("verify_raises", [False, True])
+def test_chain_with_malformed_key_keeps_old_chain(alice: Node, evil_node_maker: EvilNodeMaker,
+                                                  monkeypatch: Any, verify_raises: bool) -> None:
+    h1 = alice.mine_block()
+    bad_coin = Transaction(PublicKey(b"short"), None, Signature(secrets.token_bytes(48)))
+    block1 = Block(GENESIS_BLOCK_PREV, [bad_coin])
+    spend = Transaction(alice.get_address(), bad_coin.get_txid(), Signature(secrets.token_bytes(64)))
+    reward2 = Transaction(alice.get_address(), None, Signature(secrets.token_bytes(48)))
+    block2 = Block(block1.get_block_hash(), [spend, reward2])
+    reward3 = Transaction(alice.get_address(), None, Signature(secrets.token_bytes(48)))
+    block3 = Block(block2.get_block_hash(), [reward3])
+    evil_node = evil_node_maker([block1, block2, block3])
+
+    if verify_raises:
+        # an unexpected error while validating is reported, and the node is still on its own chain
+        def raising_verify(message: bytes, sig: Signature, pub_key: PublicKey) -> bool:
+            raise ValueError("malformed key")
+        monkeypatch.setattr(ex2.node, "verify", raising_verify)
+        with pytest.raises(ValueError):
+            alice.notify_of_block(evil_node.get_latest_hash(), evil_node)
+    else:
+        alice.notify_of_block(evil_node.get_latest_hash(), evil_node)
+    assert alice.get_latest_hash() == h1
+    assert alice.get_balance() == 1
+
+
+def test_served_block_is_checked_against_its_contents(alice: Node, bob: Node) -> None:
+    block = Block(GENESIS_BLOCK_PREV, [Transaction(bob.get_address(), None, Signature(secrets.token_bytes(48)))])
+    stale_hash = block.get_block_hash()
+    block.get_transactions()[:] = [Transaction(bob.get_address(), None, Signature(secrets.token_bytes(48)))]
+    assert block.get_block_hash() != stale_hash
+    evil_node = Mock()
+    evil_node.get_block.return_value = block
+
+    alice.notify_of_block(stale_hash, evil_node)
+    assert alice.get_latest_hash() == GENESIS_BLOCK_PREV
+
+    real_hash = Block(GENESIS_BLOCK_PREV, list(block.get_transactions())).get_block_hash()
+    alice.notify_of_block(real_hash, evil_node)
+    assert alice.get_latest_hash() == real_hash
+    assert alice.get_block(real_hash).get_block_hash() == real_hash
+
+
+def test_transactions_propagate_through_a_long_line_of_nodes() -> None:
+    nodes = [Node() for _ in range(1500)]
+    for left, right in zip(nodes, nodes[1:]):
+        left.connect(right)
+    nodes[0].mine_block()
+    tx = nodes[0].create_transaction(nodes[-1].get_address())
+    assert tx is not None
+    assert tx in nodes[-1].get_mempool()